@@ -1,17 +1,17 @@
 import asyncio
 import logging
+import random
 import signal
 import sys
-from pathlib import Path
-
-# Добавляем корень проекта в путь
-sys.path.insert(0, str(Path(__file__).resolve().parent))
+from concurrent.futures import ThreadPoolExecutor
 
 from src import config
 from src.db import init_pool, close_pool, create_tables
-from src.telegram_bot import start_bot, stop_bot, notify_callback
+from src.ai_brain import brain, batch_classifier
+from src.telegram_bot import start_bot, stop_bot, notify_callback, BatchedNotifier
 from src.telegram_listener import (
     start_listener,
+    set_recovery_flag,
     stop_listener,
     set_notify_callback as listener_set_notify,
     set_classify_callback,
@@ -54,14 +54,31 @@ def setup_logging():
 
 logger = logging.getLogger("jarvis.main")
 
+# Потоки для run_in_executor(None, ...) — DNS (getaddrinfo), синхронные библиотеки
+DEFAULT_EXECUTOR_WORKERS = 8
+
+# Все модули уведомляют владельца через общую очередь с батчингом
+notifier = BatchedNotifier(notify_callback)
+
 
 # ─── Запуск ──────────────────────────────────────────────────
 
 async def main():
     setup_logging()
-    logger.info("=" * 50)
-    logger.info("JARVIS запускается...")
-    logger.info("=" * 50)
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("=" * 50)
+        logger.info("JARVIS запускается...")
+        logger.info("=" * 50)
+
+    # Сигналы обрабатываются loop'ом между колбэками (без EINTR посреди I/O).
+    # На Windows add_signal_handler не поддерживается — там остаётся KeyboardInterrupt
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, _handle_signal, sig, main_task)
+        except NotImplementedError:
+            pass
 
     # 0. Валидация конфигурации (fail fast)
     config.validate_config()
@@ -74,7 +91,7 @@ async def main():
     logger.info("PostgreSQL OK")
 
     # 2. Привязка callbacks (все модули уведомляют через бот)
-    listener_set_notify(notify_callback)
+    listener_set_notify(notifier)
     set_classify_callback(process_classification)
     # A2: Передаём bot_id чтобы listener не классифицировал диалог с ботом
     try:
@@ -82,25 +99,28 @@ async def main():
         set_bot_id(bot_id)
     except (ValueError, IndexError):
         logger.warning("Не удалось извлечь bot_id из TELEGRAM_BOT_TOKEN")
-    confidence_set_notify(notify_callback)
-    scheduler_set_notify(notify_callback)
-    watchdog_set_notify(notify_callback)
-
-    # 3. Запуск модулей параллельно
-    tasks = [
-        asyncio.create_task(start_bot(), name="telegram_bot"),
-        asyncio.create_task(_resilient_listener(), name="telegram_listener"),
-        asyncio.create_task(start_watchdog(), name="watchdog"),
-    ]
+    confidence_set_notify(notifier)
+    scheduler_set_notify(notifier)
+    watchdog_set_notify(notifier)
+    brain.set_notify_callback(notifier)
 
-    # Scheduler запускается синхронно (APScheduler внутренне async)
-    await start_scheduler()
-
-    logger.info("Все модули запущены")
-
-    # 4. Ожидание завершения (Ctrl+C)
+    # 3. Запуск модулей параллельно; TaskGroup ждёт все задачи (4. до Ctrl+C),
+    # а при падении одной — отменяет остальные, без «осиротевших» задач
     try:
-        await asyncio.gather(*tasks)
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(start_bot(), name="telegram_bot")
+                tg.create_task(_resilient_listener(), name="telegram_listener")
+                tg.create_task(start_watchdog(), name="watchdog")
+                tg.create_task(notifier.run(), name="notifier")
+
+                # Scheduler запускается синхронно (APScheduler внутренне async)
+                await start_scheduler()
+
+                logger.info("Все модули запущены")
+        except* Exception as eg:
+            for exc in eg.exceptions:
+                logger.error("Модуль упал: %r", exc, exc_info=exc)
     except asyncio.CancelledError:
         logger.info("Получен сигнал остановки")
 
@@ -112,21 +132,20 @@ async def _resilient_listener():
     max_delay = 300  # 5 мин максимум
     notified_down = False
 
-    while not _shutting_down:
+    while not _shutdown_event.is_set():
         try:
             # Если это retry после падения — ставим флаг для уведомления
-            from src.telegram_listener import set_recovery_flag
             if notified_down:
                 set_recovery_flag()
             await start_listener()
             break  # Нормальное завершение (shutdown)
         except Exception as e:
-            logger.error(f"Telethon crashed: {e}")
+            logger.error("Telethon crashed: %s", e)
             # Одно уведомление при первом падении
             if not notified_down:
                 notified_down = True
                 try:
-                    await notify_callback(
+                    await notifier(
                         "⚠️ <b>Telethon отключён</b>\n"
                         "Мониторинг чатов не работает. Бот отвечает, но не видит новые сообщения.\n"
                         "Буду пробовать переподключиться автоматически."
@@ -138,44 +157,73 @@ async def _resilient_listener():
                 await stop_listener()
             except Exception:
                 pass
-            # Ждём перед ретраем (exponential backoff)
-            await asyncio.sleep(retry_delay)
-            retry_delay = min(retry_delay * 2, max_delay)
+            # Ждём перед ретраем (backoff с джиттером — без синхронных штормов реконнектов),
+            # но просыпаемся сразу, если начался shutdown
+            try:
+                await asyncio.wait_for(
+                    _shutdown_event.wait(),
+                    timeout=random.uniform(retry_delay, retry_delay * 3),
+                )
+                return
+            except asyncio.TimeoutError:
+                pass
+            retry_delay = min(retry_delay * 3, max_delay)
             logger.info("Telethon: попытка переподключения...")
 
 
-_shutting_down = False
+_shutdown_event = asyncio.Event()
 
 
 async def shutdown():
-    global _shutting_down
-    if _shutting_down:
+    if _shutdown_event.is_set():
         return
-    _shutting_down = True
+    _shutdown_event.set()
     logger.info("Останавливаю JARVIS...")
     await stop_scheduler()
     await stop_listener()
     await stop_bot()
+    await batch_classifier.aclose()
+    await brain.aclose()
     await close_pool()
     logger.info("JARVIS остановлен")
 
 
-def handle_signal(sig, frame):
-    logger.info(f"Сигнал {sig}, останавливаю...")
-    loop = asyncio.get_event_loop()
-    loop.create_task(shutdown())
+def _handle_signal(sig: signal.Signals, main_task: asyncio.Task):
+    """Отменяет main(): TaskGroup гасит модули, дальше shutdown() в run()."""
+    logger.info("Сигнал %s, останавливаю...", sig.name)
+    main_task.cancel()
 
 
-if __name__ == "__main__":
-    signal.signal(signal.SIGINT, handle_signal)
-    signal.signal(signal.SIGTERM, handle_signal)
+def run():
+    """Точка входа: python main.py или python -m src."""
+    # uvloop — быстрый event loop на libuv (только Linux/macOS), иначе stdlib
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
+    # Python 3.12+: корутины выполняются синхронно до первого реального await
+    if hasattr(asyncio, "eager_task_factory"):
+        loop.set_task_factory(asyncio.eager_task_factory)
+    # Явно ограниченный default executor (вместо min(32, cpu+4) потоков)
+    loop.set_default_executor(
+        ThreadPoolExecutor(max_workers=DEFAULT_EXECUTOR_WORKERS, thread_name_prefix="jarvis")
+    )
     try:
         loop.run_until_complete(main())
     except KeyboardInterrupt:
         logger.info("Прервано пользователем")
+    except asyncio.CancelledError:
+        # Сигнал пришёл ещё до запуска модулей
+        logger.info("Получен сигнал остановки")
     finally:
         loop.run_until_complete(shutdown())
+        loop.run_until_complete(loop.shutdown_default_executor())
         loop.close()
+
+
+if __name__ == "__main__":
+    run()
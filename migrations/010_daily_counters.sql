@@ -0,0 +1,7 @@
+-- Миграция 010: дневные счётчики (лимит confidence-вопросов переживает рестарт)
+CREATE TABLE IF NOT EXISTS daily_counters (
+    name        TEXT NOT NULL,           -- 'confidence_questions'
+    day         DATE NOT NULL,
+    count       INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (name, day)
+);
@@ -44,6 +44,8 @@ python3.11 -m venv venv
 source venv/bin/activate
 pip install --upgrade pip
 pip install -r requirements.txt
+# Пакет ставится в venv (editable) — импорты src.* без правки sys.path
+pip install -e .
 
 # --- Systemd сервис ---
 echo "[6/7] Создание systemd сервиса..."
@@ -57,7 +59,7 @@ Wants=postgresql.service
 Type=simple
 User=$USER
 WorkingDirectory=/opt/jarvis
-ExecStart=/opt/jarvis/venv/bin/python main.py
+ExecStart=/opt/jarvis/venv/bin/python -m src
 Restart=always
 RestartSec=10
 StartLimitIntervalSec=300
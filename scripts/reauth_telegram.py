@@ -1,29 +1,48 @@
 """
 Скрипт переавторизации Telethon.
-Запуск: python3 reauth_telegram.py
+Запуск (из корня проекта): python3 -m scripts.reauth_telegram
 Используется когда Telegram запрашивает повторный вход.
 """
 import asyncio
-import sys
-from pathlib import Path
-
-sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import getpass
 
 from telethon import TelegramClient
+from telethon.errors import SessionPasswordNeededError
+from telethon.sessions import SQLiteSession
 from src import config
 
 
+async def _ainput(prompt: str, secret: bool = False) -> str:
+    """Ввод с клавиатуры в executor — не блокирует event loop."""
+    loop = asyncio.get_running_loop()
+    reader = getpass.getpass if secret else input
+    return (await loop.run_in_executor(None, reader, prompt)).strip()
+
+
 async def main():
+    # Та же SQLite-сессия, что у listener; сущности при разовом входе не кэшируем
+    session = SQLiteSession("jarvis_session")
+    session.save_entities = False
     client = TelegramClient(
-        "jarvis_session",
+        session,
         config.TELEGRAM_API_ID,
         config.TELEGRAM_API_HASH,
     )
-    await client.start(phone=config.TELEGRAM_PHONE)
-    me = await client.get_me()
-    print(f"Авторизован как: {me.first_name} {me.last_name or ''} (@{me.username})")
-    print("Сессия сохранена. Можно закрывать.")
-    await client.disconnect()
+    await client.connect()
+    try:
+        if not await client.is_user_authorized():
+            await client.send_code_request(config.TELEGRAM_PHONE)
+            code = await _ainput("Код из Telegram: ")
+            try:
+                await client.sign_in(phone=config.TELEGRAM_PHONE, code=code)
+            except SessionPasswordNeededError:
+                password = await _ainput("Пароль 2FA: ", secret=True)
+                await client.sign_in(password=password)
+        me = await client.get_me()
+        print(f"Авторизован как: {me.first_name} {me.last_name or ''} (@{me.username})")
+        print("Сессия сохранена. Можно закрывать.")
+    finally:
+        await client.disconnect()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,4 @@
+"""Запуск JARVIS как модуля: python -m src"""
+from main import run
+
+run()
@@ -0,0 +1,64 @@
+"""
+Кеш результатов классификации.
+
+Повторяющиеся «ок», «+», шаблонные рассылки и пересланные шутки не должны
+каждый раз уходить в модель. Ключ — sha256 от модели, направления (от владельца /
+к владельцу), области (scope) и нормализованного текста: длинные тексты не хранятся
+в памяти целиком, а ответ Sonnet (каскад) не смешивается с ответом Haiku.
+
+scope — чат и отправитель: who и assignee в результате зависят от них, без scope
+«привезу сегодня» из одного чата вернул бы задачу с чужим исполнителем. Результаты
+с дедлайном вызывающий код не кеширует — относительная дата не переживает полночь.
+"""
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import Optional
+
+CLASSIFY_CACHE_MAX = 10_000
+CLASSIFY_CACHE_TTL = 6 * 3600.0
+
+_URL_RE = re.compile(r"https?://\S+")
+_WS_RE = re.compile(r"\s+")
+
+
+class ClassificationCache:
+    """LRU + TTL кеш классификаций по нормализованному тексту.
+    Нормализация: регистр, пробелы, URL → <url>. Цифры не маскируются —
+    от них зависят дедлайны."""
+
+    def __init__(self, max_size: int = CLASSIFY_CACHE_MAX, ttl: float = CLASSIFY_CACHE_TTL):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._data: OrderedDict[bytes, tuple[dict, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(text: str, owner_is_sender: bool, model: str, scope: str) -> bytes:
+        normalized = _WS_RE.sub(" ", _URL_RE.sub("<url>", text.lower())).strip()
+        return hashlib.sha256(f"{model}|{int(owner_is_sender)}|{scope}\0{normalized}".encode()).digest()
+
+    def get(self, text: str, owner_is_sender: bool, model: str = "haiku", scope: str = "") -> Optional[dict]:
+        key = self._key(text, owner_is_sender, model, scope)
+        entry = self._data.get(key)
+        if entry is not None and time.monotonic() - entry[1] > self._ttl:
+            del self._data[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._data.move_to_end(key)
+        return dict(entry[0])
+
+    def put(self, text: str, owner_is_sender: bool, result: dict, model: str = "haiku", scope: str = ""):
+        key = self._key(text, owner_is_sender, model, scope)
+        self._data[key] = (dict(result), time.monotonic())
+        self._data.move_to_end(key)
+        while len(self._data) > self._max_size:
+            self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,81 @@
+"""
+Прогретые процессы Claude CLI.
+
+`claude -p` отвечает на один промпт и завершается, поэтому держать один процесс
+на много запросов нельзя. Вместо этого следующий процесс запускается заранее и
+ждёт промпт в stdin — старт Node и загрузка CLI не входят в задержку запроса.
+Неиспользованный процесс гасится через CLAUDE_SESSION_IDLE_TIMEOUT секунд.
+"""
+import asyncio
+import logging
+from typing import Optional
+
+from src import config
+
+logger = logging.getLogger("jarvis.claude_session")
+
+
+class ClaudeSession:
+    """Один тёплый `claude -p --model <model>` на модель."""
+
+    def __init__(self, model_flag: str, idle_timeout: float = config.CLAUDE_SESSION_IDLE_TIMEOUT):
+        self._model_flag = model_flag
+        self._idle_timeout = idle_timeout
+        self._warm: Optional[asyncio.subprocess.Process] = None
+        self._expire_task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    async def _spawn(self) -> asyncio.subprocess.Process:
+        return await asyncio.create_subprocess_exec(
+            "claude", "-p", "--model", self._model_flag,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+    async def take(self) -> asyncio.subprocess.Process:
+        """Процесс, готовый принять промпт в stdin. Тёплый — если жив, иначе новый.
+        Сразу после выдачи греется следующий."""
+        proc, self._warm = self._warm, None
+        if self._expire_task:
+            self._expire_task.cancel()
+            self._expire_task = None
+        if proc is None or proc.returncode is not None:
+            proc = await self._spawn()
+
+        if self._idle_timeout > 0 and not self._closed:
+            try:
+                warm = await self._spawn()
+            except OSError as e:
+                logger.warning("Claude CLI: не удалось прогреть процесс: %s", e)
+            else:
+                # Пока шёл spawn, параллельный take() мог уже прогреть свой процесс,
+                # а close() — закрыть сессию: лишний процесс сразу гасим, не перезаписываем
+                if self._warm is not None or self._closed:
+                    await self._kill(warm)
+                else:
+                    self._warm = warm
+                    self._expire_task = asyncio.create_task(self._expire(warm))
+        return proc
+
+    async def _expire(self, proc: asyncio.subprocess.Process):
+        await asyncio.sleep(self._idle_timeout)
+        if self._warm is proc:
+            self._warm = None
+            self._expire_task = None
+            await self._kill(proc)
+
+    @staticmethod
+    async def _kill(proc: asyncio.subprocess.Process):
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+    async def close(self):
+        self._closed = True
+        if self._expire_task:
+            self._expire_task.cancel()
+            self._expire_task = None
+        if self._warm:
+            await self._kill(self._warm)
+            self._warm = None
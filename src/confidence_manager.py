@@ -1,20 +1,28 @@
 import asyncio
+import difflib
+import functools
 import logging
+import re
+import time
 from datetime import datetime, date, timedelta, timezone
+from types import MappingProxyType
 
 from src import config
 from src.db import (
     add_to_confidence_queue,
+    take_daily_slot,
     create_task,
     has_similar_active_task,
     get_pending_confidence,
-    get_setting,
+    get_setting_cached,
     resolve_confidence,
+    resolve_confidence_bulk,
+    get_active_task_descriptions,
     mark_message_processed,
     get_context_for_classification,
     get_recent_chat_messages,
 )
-from src.ai_brain import brain
+from src.ai_brain import brain, batch_classifier
 
 
 # v6: Метки типов для прозрачных уведомлений
@@ -29,6 +37,44 @@ _TYPE_LABELS = {
 }
 
 
+# Метки типа в вопросах владельцу: срочный вопрос и вечерний батч
+_URGENT_LABELS = MappingProxyType({
+    "task": "задача",
+    "promise_mine": "моё обещание",
+    "promise_incoming": "чужое обещание",
+    "question": "вопрос",
+})
+_BATCH_LABELS = MappingProxyType({
+    "task": "задача",
+    "promise_mine": "обещание",
+    "promise_incoming": "обещание",
+    "question": "вопрос",
+})
+
+
+# Уведомления по зонам confidence: format_map по полям сообщения (см. process_classification)
+_HIGH_NOTIFY = (
+    "🔔 <b>Авто-задача #{task_id}</b> ({confidence}%)\n"
+    "📝 {summary}\n"
+    "👤 {sender_name} → {who}\n"
+    "🗂 {type_label}\n"
+    "📱 {account}{link_html}"
+)
+_MEDIUM_NOTIFY = (
+    "❓ <b>Похоже на задачу</b> ({confidence}%)\n"
+    "📝 {summary}\n"
+    "👤 {sender_name}\n"
+    "🗂 {type_label}\n"
+    "📱 {account}{link_html}"
+)
+_LOW_NOTIFY = (
+    "ℹ️ <b>{type_label}</b> ({confidence}%)\n"
+    "📝 {summary}\n"
+    "👤 {sender_name}\n"
+    "📱 {account}{link_html}"
+)
+
+
 def _type_label(t: str) -> str:
     return _TYPE_LABELS.get(t, t)
 
@@ -44,41 +90,113 @@ def set_notify_callback(callback):
 
 
 async def notify_owner(text: str, **kwargs):
+    # callback — BatchedNotifier из telegram_bot: только кладёт в свою очередь,
+    # отправка в Telegram идёт в его воркере, классификация её не ждёт
     if _notify_callback:
         await _notify_callback(text, **kwargs)
 
 
-# Счётчик вопросов за сегодня
-_today_questions = 0
-_today_date = None
+# Общий лимит одновременных классификаций и пакетного создания задач:
+# поток сообщений не копит сотни запросов к API, а разбор батча не вытесняет живые сообщения
+CLASSIFY_SEM = asyncio.Semaphore(config.CLASSIFY_CONCURRENCY)
+
+
+async def _create_task_limited(**kwargs):
+    async with CLASSIFY_SEM:
+        return await create_task(**kwargs)
+
 
+# Фоновые задачи (уведомления, очередь confidence): классификация не ждёт их.
+# Ссылки держим в множестве, иначе незавершённую задачу может собрать GC
+_bg_tasks: set[asyncio.Task] = set()
 
-def _reset_daily_counter():
-    global _today_questions, _today_date
-    today = date.today()
-    if _today_date != today:
-        _today_questions = 0
-        _today_date = today
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _bg_tasks.add(task)
+    task.add_done_callback(_on_bg_done)
+    return task
+
+
+def _on_bg_done(task: asyncio.Task):
+    _bg_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Фоновая задача confidence упала: {task.exception()!r}")
+
+
+async def _take_question_slot() -> bool:
+    """Счётчик вопросов за сегодня — в БД (daily_counters): переживает рестарт,
+    проверка лимита и +1 одним UPSERT. False — лимит исчерпан."""
+    limit = int(await get_setting_cached("confidence_daily_limit", str(config.CONFIDENCE_DAILY_LIMIT)))
+    return await take_daily_slot("confidence_questions", date.today(), limit)
 
 
 # ─── B3: Отложенное уведомление для MEDIUM (5 мин буфер) ────
 
 _MEDIUM_DELAY_SEC = 300  # 5 минут
 
+# Локальная проверка «задача разрешилась» до вызова AI
+_RESOLVED_RE = re.compile(
+    r"\b(сделал[аи]?|сделано|готово|выполнил[аи]?|выполнено|отменил[аи]?|отменено|отмена"
+    r"|решил[аи]?|решено|разобрал(?:ся|ась|ись)|неактуально|не актуально|уже не надо"
+    r"|отправил[аи]?|оплатил[аи]?|done)\b",
+    re.IGNORECASE,
+)
+# «не сделал», «ещё не до конца готово» — отрицание перед совпадением (до двух слов между)
+_NEGATION_BEFORE_RE = re.compile(r"\b(?:не|ни)\s+(?:\w+\s+){0,2}$", re.IGNORECASE)
+
+
+def _exclude_trigger(recent: list, trigger_id: int | None) -> list:
+    """Без сообщения, из которого задача: само по себе оно её не разрешает
+    («Я отправил договор, подпиши до пятницы» — это поручение, а не отчёт)."""
+    if trigger_id is None:
+        return recent
+    return [m for m in recent if m.get("id") != trigger_id]
+
+
+def _local_resolved(recent: list) -> bool | None:
+    """True — разрешилась, False — точно нет, None — непонятно (решает AI).
+    Разрешилась — только явное «готово/сделал/отменили…» владельца без отрицания.
+    Никто не писал о решении и владелец молчит — нет. Остальные ответы владельца
+    (вопрос, отрицание, обсуждение по теме) — решает AI."""
+    # Владелец ответил не по шаблону или контакт пишет о решении — пусть смотрит AI
+    uncertain = False
+    for m in recent:
+        text = m.get("text") or ""
+        if not config.is_owner(m.get("sender_id", 0)):
+            uncertain = uncertain or bool(_RESOLVED_RE.search(text))
+            continue
+        if text.rstrip().endswith("?"):
+            uncertain = True
+            continue
+        match = _RESOLVED_RE.search(text)
+        if match:
+            if _NEGATION_BEFORE_RE.search(text, 0, match.start()):
+                uncertain = True
+                continue
+            return True
+        uncertain = True
+    return None if uncertain else False
+
 
 async def _delayed_medium_notify(
     chat_id: int,
     summary: str,
     notify_text: str,
     notify_kwargs: dict,
+    trigger_id: int | None = None,
 ):
     """B3: Ждёт 5 минут, проверяет не разрешилась ли задача сама,
     затем отправляет уведомление если задача всё ещё актуальна."""
     await asyncio.sleep(_MEDIUM_DELAY_SEC)
     try:
         since = datetime.now(timezone.utc) - timedelta(seconds=_MEDIUM_DELAY_SEC + 30)
-        recent = await get_recent_chat_messages(chat_id, since, limit=8)
-        if recent:
+        recent = _exclude_trigger(await get_recent_chat_messages(chat_id, since, limit=8), trigger_id)
+        resolved = _local_resolved(recent)
+        if resolved:
+            logger.info(f"B3: MEDIUM задача разрешилась (локально), уведомление отменено: {summary[:60]}")
+            return
+        if resolved is None:
             messages_text = "\n".join(
                 f"[{'ВЛАДЕЛЕЦ' if config.is_owner(m.get('sender_id', 0)) else m.get('sender_name', '?')}]: {(m.get('text') or '')[:150]}"
                 for m in recent
@@ -104,6 +222,99 @@ async def _delayed_medium_notify(
         logger.error(f"B3: ошибка отправки MEDIUM уведомления: {e}")
 
 
+# ─── Каскад Haiku → Sonnet ───────────────────────────────────
+
+# Раз в N классификаций — в лог доля эскалаций на Sonnet (для подбора границ)
+_CASCADE_LOG_EVERY = 100
+_cascade_total = 0
+_cascade_escalated = 0
+
+
+def _needs_escalation(result: dict) -> bool:
+    """Сомнительный ответ Haiku: MEDIUM-зона или невалидный JSON (confidence 0)."""
+    confidence = result.get("confidence", 0)
+    return confidence == 0 or config.CONFIDENCE_LOW <= confidence <= config.CONFIDENCE_HIGH
+
+
+def _count_cascade(escalated: bool):
+    global _cascade_total, _cascade_escalated
+    _cascade_total += 1
+    _cascade_escalated += escalated
+    if _cascade_total % _CASCADE_LOG_EVERY == 0:
+        logger.info(
+            f"Каскад: {_cascade_escalated}/{_cascade_total} "
+            f"({_cascade_escalated * 100 / _cascade_total:.0f}%) эскалировано на Sonnet"
+        )
+
+
+# ─── Дедупликация задач без запроса на каждое сообщение ──────
+
+_ACTIVE_DESC_TTL = 30  # секунд
+_SIMILAR_RATIO = 0.85       # ≥ — дубль
+_SIMILAR_BORDERLINE = 0.75  # [0.75, 0.85) — пусть решает БД
+
+_active_desc_cache: list[str] = []
+_active_desc_time: float = 0
+
+
+async def _active_descriptions() -> list[str]:
+    """Описания активных задач (в нижнем регистре), кеш на _ACTIVE_DESC_TTL секунд."""
+    global _active_desc_cache, _active_desc_time
+    now = time.monotonic()
+    if now - _active_desc_time >= _ACTIVE_DESC_TTL:
+        _active_desc_cache = [d.lower() for d in await get_active_task_descriptions()]
+        _active_desc_time = now
+    return _active_desc_cache
+
+
+def _remember_active(description: str):
+    """Только что созданная задача сразу участвует в дедупликации, не дожидаясь TTL."""
+    _active_desc_cache.append(description.lower())
+
+
+def _similar_local(description: str, existing: list[str]) -> bool | None:
+    """True — дубль, False — точно нет, None — пограничный случай.
+    Совпадение начала описания — как ILIKE в has_similar_active_task, плюс
+    SequenceMatcher.quick_ratio (верхняя оценка) и ratio для кандидатов."""
+    short = description[:70].strip().lower()
+    if not short:
+        return False
+    best = 0.0
+    matcher = difflib.SequenceMatcher(b=short, autojunk=False)
+    for d in existing:
+        if short in d:
+            return True
+        matcher.set_seq1(d)
+        if matcher.real_quick_ratio() >= _SIMILAR_BORDERLINE and matcher.quick_ratio() >= _SIMILAR_BORDERLINE:
+            best = max(best, matcher.ratio())
+            if best >= _SIMILAR_RATIO:
+                return True
+    return None if best >= _SIMILAR_BORDERLINE else False
+
+
+async def _is_duplicate_task(description: str) -> bool:
+    """Проверка дубля по кешу активных задач; БД — только для пограничных случаев."""
+    similar = _similar_local(description, await _active_descriptions())
+    if similar is None:
+        return await has_similar_active_task(description)
+    return similar
+
+
+@functools.lru_cache(maxsize=512)
+def _parse_deadline(deadline_str: str) -> datetime | None:
+    """Дедлайн из ответа AI → UTC-aware datetime (для PostgreSQL TIMESTAMPTZ).
+    Кешируется: модель часто повторяет одни и те же даты, в т.ч. неразбираемые."""
+    if not deadline_str:
+        return None
+    try:
+        deadline = datetime.fromisoformat(deadline_str)
+    except ValueError:
+        return None
+    if deadline.tzinfo is None:
+        deadline = deadline.replace(tzinfo=timezone.utc)
+    return deadline
+
+
 # ─── Основная логика классификации ───────────────────────────
 
 async def process_classification(
@@ -114,9 +325,28 @@ async def process_classification(
     chat_id: int,
     sender_id: int = 0,
     account_label: str = "",
+):
+    """Точка входа из listener: не больше CLASSIFY_CONCURRENCY классификаций одновременно."""
+    async with CLASSIFY_SEM:
+        await _classify_and_route(
+            db_msg_id, text, sender_name, chat_title, chat_id,
+            sender_id=sender_id, account_label=account_label,
+        )
+
+
+async def _classify_and_route(
+    db_msg_id: int,
+    text: str,
+    sender_name: str,
+    chat_title: str,
+    chat_id: int,
+    sender_id: int = 0,
+    account_label: str = "",
 ):
     """Классификация сообщения AI и обработка по уровню confidence.
     v6: прозрачность для ВСЕХ 3 зон + original_type + авто-remind + feedback."""
+    # Время получения сообщения: авто-remind отсчитывается от него, а не от ответа AI
+    now_utc = datetime.now(timezone.utc)
     try:
         # B1: загружаем расширенный контекст (10 сообщений до текущего включительно)
         context_messages = await get_context_for_classification(chat_id, db_msg_id, limit=10)
@@ -124,32 +354,66 @@ async def process_classification(
         # v4: определяем направление — от владельца или к владельцу
         owner_is_sender = config.is_owner(sender_id) if sender_id else False
 
-        result = await brain.classify_message(
+        # Сообщения, пришедшие почти одновременно, классифицируются одним запросом (Haiku)
+        result = await batch_classifier.submit(
             text, sender_name, chat_title,
             context_messages=context_messages,
             owner_is_sender=owner_is_sender,
         )
+        # Каскад: сомнительный ответ Haiku перепроверяет Sonnet, уверенный — остаётся
+        escalate = _needs_escalation(result)
+        _count_cascade(escalate)
+        if escalate:
+            result = await brain.classify_message(
+                text, sender_name, chat_title,
+                context_messages=context_messages,
+                owner_is_sender=owner_is_sender,
+                model="sonnet",
+            )
 
         msg_type = result.get("type", "info")
         confidence = result.get("confidence", 0)
-        summary = result.get("summary", text[:100])
+        summary = result.get("summary") or text[:100]
+
+        # v6: сохраняем original_type ДО нормализации (для уведомлений и feedback)
+        original_type = msg_type
+
+        # Deep link: для ЛС chat_id = user_id → tg://user открывает чат
+        # Для групп нужен telegram_msg_id (не передаётся), оставляем пустым
+        if chat_id and chat_id > 0:
+            link_html = f' <a href="tg://user?id={chat_id}">📎</a>'
+        else:
+            link_html = ""
+
+        # Общие поля текстов уведомлений
+        fields = {
+            "confidence": confidence, "summary": summary, "sender_name": sender_name,
+            "type_label": _type_label(original_type), "account": account_label,
+            "link_html": link_html,
+        }
+
+        # <50% — уведомляет информационно. Самая частая зона: дедлайн, remind_at
+        # и тип для БД ей не нужны, поэтому выходим до их разбора
+        if confidence < config.CONFIDENCE_LOW:
+            await notify_owner(
+                _LOW_NOTIFY.format_map(fields),
+                reply_markup_type="classify_low",
+                message_id=db_msg_id,
+                extra={"original_type": original_type, "confidence": confidence,
+                       "summary": summary, "sender_name": sender_name,
+                       "sender_id": sender_id, "chat_id": chat_id,
+                       "chat_title": chat_title, "account": account_label,
+                       "zone": "low"},
+            )
+            logger.debug(f"Classify LOW ({confidence}%): {summary}")
+            return
+
         deadline_str = result.get("deadline")
         who = result.get("who")
         is_urgent = result.get("is_urgent", False)
         assignee = result.get("assignee")  # v4: кому назначена задача
 
-        # Парсинг дедлайна (всегда UTC-aware для PostgreSQL TIMESTAMPTZ)
-        deadline = None
-        if deadline_str:
-            try:
-                deadline = datetime.fromisoformat(deadline_str)
-                if deadline.tzinfo is None:
-                    deadline = deadline.replace(tzinfo=timezone.utc)
-            except (ValueError, TypeError):
-                pass
-
-        # v6: сохраняем original_type ДО нормализации (для уведомлений и feedback)
-        original_type = msg_type
+        deadline = _parse_deadline(deadline_str) if isinstance(deadline_str, str) else None
 
         # v6: track_completion для исходящих задач И чужих обещаний
         track = original_type in ("task_from_me", "promise_incoming")
@@ -160,26 +424,19 @@ async def process_classification(
             if deadline:
                 remind_at = deadline - timedelta(hours=2)
             else:
-                remind_at = datetime.now(timezone.utc) + timedelta(hours=24)
+                remind_at = now_utc + timedelta(hours=24)
 
         # Нормализуем тип для БД (DB constraint: task, promise_mine, promise_incoming)
         db_type = msg_type
         if db_type in ("task_from_me", "task_for_me", "question"):
             db_type = "task"
 
-        # Deep link: для ЛС chat_id = user_id → tg://user открывает чат
-        # Для групп нужен telegram_msg_id (не передаётся), оставляем пустым
-        if chat_id and chat_id > 0:
-            link_html = f' <a href="tg://user?id={chat_id}">📎</a>'
-        else:
-            link_html = ""
-
-        # v6: Три зоны confidence — ВСЕ прозрачны для владельца
+        # v6: Остальные две зоны confidence (LOW обработана выше)
         if confidence > config.CONFIDENCE_HIGH:
             # >90% — создаёт задачу + уведомляет
             if db_type in ("task", "promise_mine", "promise_incoming"):
                 # v9: дедупликация для автоматической классификации (убрана из create_task)
-                if await has_similar_active_task(summary):
+                if await _is_duplicate_task(summary):
                     logger.info(f"Дубль задачи пропущен (classify HIGH): {summary[:60]}")
                     return
                 task_id = await create_task(
@@ -197,15 +454,14 @@ async def process_classification(
                     account=account_label,
                     track_completion=track,
                 )
+                # Только после успешной вставки: упавший INSERT не оставляет фантомный дубль
+                if task_id:
+                    _remember_active(summary)
                 logger.info(f"Задача #{task_id} создана (confidence {confidence}%): {summary}")
 
                 # v6: Прозрачное уведомление (HIGH)
                 await notify_owner(
-                    f"🔔 <b>Авто-задача #{task_id}</b> ({confidence}%)\n"
-                    f"📝 {summary}\n"
-                    f"👤 {sender_name} → {who or assignee or '?'}\n"
-                    f"🗂 {_type_label(original_type)}\n"
-                    f"📱 {account_label}{link_html}",
+                    _HIGH_NOTIFY.format_map(fields | {"task_id": task_id, "who": who or assignee or "?"}),
                     reply_markup_type="classify_high",
                     task_id=task_id,
                     message_id=db_msg_id,
@@ -220,16 +476,10 @@ async def process_classification(
                 # HIGH но info/question/spam — просто лог
                 logger.info(f"Классификация HIGH {original_type} ({confidence}%): {summary}")
 
-        elif confidence >= config.CONFIDENCE_LOW:
+        else:
             # 50-90% — НЕ создаёт задачу, спрашивает владельца (B3: через 5 мин)
             if db_type in ("task", "promise_mine", "promise_incoming", "question"):
-                notify_text = (
-                    f"❓ <b>Похоже на задачу</b> ({confidence}%)\n"
-                    f"📝 {summary}\n"
-                    f"👤 {sender_name}\n"
-                    f"🗂 {_type_label(original_type)}\n"
-                    f"📱 {account_label}{link_html}"
-                )
+                notify_text = _MEDIUM_NOTIFY.format_map(fields)
                 notify_kwargs = dict(
                     reply_markup_type="classify_medium",
                     message_id=db_msg_id,
@@ -247,28 +497,11 @@ async def process_classification(
                     await notify_owner(notify_text, **notify_kwargs)
                     logger.info(f"Classify MEDIUM СРОЧНОЕ → владелец ({confidence}%): {summary}")
                 else:
-                    asyncio.create_task(_delayed_medium_notify(chat_id, summary, notify_text, notify_kwargs))
+                    _spawn(_delayed_medium_notify(chat_id, summary, notify_text, notify_kwargs, db_msg_id))
                     logger.info(f"Classify MEDIUM → отложено 5 мин ({confidence}%): {summary}")
             else:
                 logger.debug(f"Классификация MEDIUM {original_type} ({confidence}%): {summary}")
 
-        # <50% — уведомляет информационно
-        else:
-            await notify_owner(
-                f"ℹ️ <b>{_type_label(original_type)}</b> ({confidence}%)\n"
-                f"📝 {summary}\n"
-                f"👤 {sender_name}\n"
-                f"📱 {account_label}{link_html}",
-                reply_markup_type="classify_low",
-                message_id=db_msg_id,
-                extra={"original_type": original_type, "confidence": confidence,
-                       "summary": summary, "sender_name": sender_name,
-                       "sender_id": sender_id, "chat_id": chat_id,
-                       "chat_title": chat_title, "account": account_label,
-                       "zone": "low"},
-            )
-            logger.debug(f"Classify LOW ({confidence}%): {summary}")
-
     except Exception as e:
         logger.error(f"Ошибка классификации: {e}", exc_info=True)
 
@@ -284,52 +517,55 @@ async def _handle_urgent(
     confidence: int,
 ):
     """Срочный confidence-вопрос — отправляет СРАЗУ, не ждёт 16:00."""
-    _reset_daily_counter()
-    global _today_questions
-
-    limit = int(await get_setting("confidence_daily_limit", str(config.CONFIDENCE_DAILY_LIMIT)))
-    if _today_questions >= limit:
+    preview = text[:150]
+    if not await _take_question_slot():
         # Лимит исчерпан — молча в очередь
-        await add_to_confidence_queue(
+        _spawn(add_to_confidence_queue(
             message_id=db_msg_id,
             chat_id=chat_id,
             sender_name=sender_name,
-            text_preview=text[:150],
+            text_preview=preview,
             predicted_type=predicted_type,
             confidence=confidence,
             is_urgent=True,
-        )
+        ))
         return
 
-    _today_questions += 1
-
-    type_label = {
-        "task": "задача",
-        "promise_mine": "моё обещание",
-        "promise_incoming": "чужое обещание",
-        "question": "вопрос",
-    }.get(predicted_type, predicted_type)
-
-    queue_id = await add_to_confidence_queue(
-        message_id=db_msg_id,
-        chat_id=chat_id,
-        sender_name=sender_name,
-        text_preview=text[:150],
-        predicted_type=predicted_type,
-        confidence=confidence,
-        is_urgent=True,
-    )
+    type_label = _URGENT_LABELS.get(predicted_type, predicted_type)
 
-    await notify_owner(
-        f"СРОЧНОЕ: {sender_name}: \"{text[:150]}\"\n"
-        f"Уверенность: {confidence}%. Это {type_label}?",
-        reply_markup_type="urgent_confidence",
-        queue_id=queue_id,
-    )
+    # queue_id нужен кнопкам уведомления — запись и уведомление одной фоновой задачей
+    async def queue_and_notify():
+        queue_id = await add_to_confidence_queue(
+            message_id=db_msg_id,
+            chat_id=chat_id,
+            sender_name=sender_name,
+            text_preview=preview,
+            predicted_type=predicted_type,
+            confidence=confidence,
+            is_urgent=True,
+        )
+        await notify_owner(
+            f"СРОЧНОЕ: {sender_name}: \"{preview}\"\n"
+            f"Уверенность: {confidence}%. Это {type_label}?",
+            reply_markup_type="urgent_confidence",
+            queue_id=queue_id,
+        )
+
+    _spawn(queue_and_notify())
 
 
 # ─── Батч-разбор (вызывается из scheduler в 16:00) ──────────
 
+def _format_batch_line(i: int, item) -> str:
+    """Строка батч-разбора: «1. [ ] Имя (14:05): "текст" — задача?»."""
+    type_label = _BATCH_LABELS.get(item["predicted_type"], item["predicted_type"])
+    time_str = item["created_at"].strftime("%H:%M") if item["created_at"] else ""
+    return (
+        f"{i}. [ ] {item['sender_name']} ({time_str}): "
+        f"\"{item['text_preview'][:80]}\" — {type_label}?"
+    )
+
+
 async def send_batch_review():
     """Отправка батча неуверенных классификаций за день."""
     pending = await get_pending_confidence(limit=config.CONFIDENCE_DAILY_LIMIT)
@@ -339,22 +575,8 @@ async def send_batch_review():
         return
 
     # Формируем сообщение
-    lines = [f"За сегодня я засомневался в {len(pending)} сообщениях:\n"]
-    for i, item in enumerate(pending, 1):
-        type_label = {
-            "task": "задача",
-            "promise_mine": "обещание",
-            "promise_incoming": "обещание",
-            "question": "вопрос",
-        }.get(item["predicted_type"], item["predicted_type"])
-
-        time_str = item["created_at"].strftime("%H:%M") if item["created_at"] else ""
-        lines.append(
-            f"{i}. [ ] {item['sender_name']} ({time_str}): "
-            f"\"{item['text_preview'][:80]}\" — {type_label}?"
-        )
-
-    text = "\n".join(lines)
+    body = "\n".join(_format_batch_line(i, item) for i, item in enumerate(pending, 1))
+    text = f"За сегодня я засомневался в {len(pending)} сообщениях:\n\n{body}"
 
     await notify_owner(
         text,
@@ -369,15 +591,13 @@ async def send_batch_review():
 
 async def resolve_batch_all_tasks(queue_ids: list[int]):
     """Пользователь нажал 'Все задачи' — A4: реально создаём задачи."""
-    for qid in queue_ids:
-        await _resolve_and_create(qid, "task")
+    await _resolve_and_create_many(queue_ids, "task")
     logger.info(f"Батч: все {len(queue_ids)} подтверждены как задачи")
 
 
 async def resolve_batch_nothing(queue_ids: list[int]):
     """Пользователь нажал 'Ничего'."""
-    for qid in queue_ids:
-        await resolve_confidence(qid, "info")
+    await resolve_confidence_bulk(queue_ids, "info")
     logger.info(f"Батч: все {len(queue_ids)} отклонены")
 
 
@@ -390,24 +610,51 @@ async def resolve_single(queue_id: int, actual_type: str):
     logger.info(f"Confidence #{queue_id} → {actual_type}")
 
 
-async def _resolve_and_create(queue_id: int, actual_type: str):
-    """Резолвит confidence и РЕАЛЬНО создаёт задачу в БД."""
-    from src.db import get_pool
-
-    # Получаем данные из confidence_queue
-    pool = await get_pool()
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow(
-            "SELECT message_id, chat_id, sender_name, text_preview, predicted_type "
-            "FROM confidence_queue WHERE id = $1",
-            queue_id,
+async def _resolve_and_create_many(queue_ids: list[int], actual_type: str):
+    """Пакетный _resolve_and_create: одна транзакция на resolve + feedback,
+    дедупликация по описаниям активных задач в памяти, задачи создаются параллельно."""
+    rows = await resolve_confidence_bulk(queue_ids, actual_type)
+    if not rows:
+        return
+    # Аналог has_similar_active_task (ILIKE '%начало описания%') без запроса на каждую
+    existing = [d.lower() for d in await get_active_task_descriptions()]
+
+    to_create = []
+    for row in rows:
+        desc = row["text_preview"] or f"Задача от {row['sender_name']}"
+        short = desc[:70].strip().lower()
+        if short and any(short in d for d in existing):
+            logger.info(f"Дубль задачи из confidence #{row['id']}")
+            continue
+        existing.append(desc.lower())
+        to_create.append((row, desc))
+
+    task_ids = await asyncio.gather(*(
+        _create_task_limited(
+            task_type=actual_type,
+            description=desc,
+            who=row["sender_name"] if actual_type == "promise_incoming" else None,
+            confidence=100,  # Подтверждено пользователем
+            source=f"confidence:{row['id']}",
+            source_msg_id=row["message_id"],
+            chat_id=row["chat_id"],
         )
+        for row, desc in to_create
+    ))
+    for (row, desc), task_id in zip(to_create, task_ids):
+        if task_id:
+            _remember_active(desc)
+            logger.info(f"Задача #{task_id} создана из confidence #{row['id']}")
 
-    await resolve_confidence(queue_id, actual_type)
 
-    if row:
+async def _resolve_and_create(queue_id: int, actual_type: str):
+    """Резолвит confidence и РЕАЛЬНО создаёт задачу в БД."""
+    # UPDATE ... RETURNING + feedback одной транзакцией — данные строки приходят сразу
+    rows = await resolve_confidence_bulk([queue_id], actual_type)
+
+    for row in rows:
         desc = row["text_preview"] or f"Задача от {row['sender_name']}"
-        if await has_similar_active_task(desc):
+        if await _is_duplicate_task(desc):
             logger.info(f"Дубль задачи из confidence #{queue_id}")
             return
         task_id = await create_task(
@@ -420,4 +667,5 @@ async def _resolve_and_create(queue_id: int, actual_type: str):
             chat_id=row["chat_id"],
         )
         if task_id:
+            _remember_active(desc)
             logger.info(f"Задача #{task_id} создана из confidence #{queue_id}")
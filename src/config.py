@@ -55,6 +55,8 @@ DB_DSN = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 # === AI ===
 AI_MODE_DEFAULT = _get("AI_MODE", "api")
 ANTHROPIC_API_KEY = _get("ANTHROPIC_API_KEY")
+# Сколько секунд держать заранее запущенный процесс Claude CLI (0 — не прогревать)
+CLAUDE_SESSION_IDLE_TIMEOUT = _get_int("CLAUDE_SESSION_IDLE_TIMEOUT", 120)
 
 # === Whisper (Фаза 2) ===
 OPENAI_API_KEY = _get("OPENAI_API_KEY")
@@ -93,6 +95,10 @@ USER_TIMEZONE_NAME = "Красноярск"
 # === Диалог ===
 CONVERSATION_WINDOW_SIZE = _get_int("CONVERSATION_WINDOW_SIZE", 20)
 
+# === Классификация ===
+# Сколько классификаций одновременно в работе (≈ параллельных запросов к Anthropic)
+CLASSIFY_CONCURRENCY = _get_int("CLASSIFY_CONCURRENCY", 8)
+
 # === Константы ===
 HEARTBEAT_INTERVAL_SEC = 300        # 5 минут
 CONFIDENCE_HIGH = 90                # >90% — молча создаёт (v4: было 80)
@@ -107,18 +113,14 @@ WEEKLY_ANALYSIS_HOUR = 3            # 03:00 UTC = 10:00 Красноярск
 
 def validate_config():
     """Проверяет обязательные переменные окружения при старте. Fail fast."""
-    errors = []
-
-    if not TELEGRAM_BOT_TOKEN:
-        errors.append("TELEGRAM_BOT_TOKEN не задан")
-    if not TELEGRAM_OWNER_ID:
-        errors.append("TELEGRAM_OWNER_ID не задан")
-    if not TELEGRAM_API_ID:
-        errors.append("TELEGRAM_API_ID не задан")
-    if not TELEGRAM_API_HASH:
-        errors.append("TELEGRAM_API_HASH не задан")
-    if not DB_PASSWORD:
-        errors.append("DB_PASSWORD не задан")
+    required = (
+        ("TELEGRAM_BOT_TOKEN", TELEGRAM_BOT_TOKEN),
+        ("TELEGRAM_OWNER_ID", TELEGRAM_OWNER_ID),
+        ("TELEGRAM_API_ID", TELEGRAM_API_ID),
+        ("TELEGRAM_API_HASH", TELEGRAM_API_HASH),
+        ("DB_PASSWORD", DB_PASSWORD),
+    )
+    errors = [f"{name} не задан" for name, value in required if not value]
 
     # API mode требует ключ
     if AI_MODE_DEFAULT == "api" and not ANTHROPIC_API_KEY:
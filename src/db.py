@@ -1,6 +1,7 @@
 import asyncpg
 import logging
 import re
+import time
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import Optional
@@ -14,6 +15,10 @@ MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "migrations"
 # Глобальный пул соединений
 _pool: Optional[asyncpg.Pool] = None
 
+# Кеш настроек для горячих путей: key → (значение, time.monotonic() чтения)
+SETTINGS_CACHE_TTL = 60.0
+_settings_cache: dict[str, tuple[str, float]] = {}
+
 
 # ─── Подключение ────────────────────────────────────────────
 
@@ -115,6 +120,26 @@ async def get_setting(key: str, default: str = "") -> str:
         return row["value"] if row else default
 
 
+async def get_setting_cached(key: str, default: str = "", ttl: float = SETTINGS_CACHE_TTL) -> str:
+    """get_setting() без запроса в БД, если значение читали меньше ttl секунд назад."""
+    cached = _settings_cache.get(key)
+    if cached and time.monotonic() - cached[1] < ttl:
+        return cached[0]
+    value = await get_setting(key, default)
+    _settings_cache[key] = (value, time.monotonic())
+    return value
+
+
+def invalidate_setting(key: str):
+    """Сбрасывает кеш одной настройки — следующее чтение пойдёт в БД."""
+    _settings_cache.pop(key, None)
+
+
+def clear_settings_cache():
+    """Сбрасывает кеш всех настроек (например, после ручной правки таблицы settings)."""
+    _settings_cache.clear()
+
+
 async def set_setting(key: str, value: str):
     pool = await get_pool()
     async with pool.acquire() as conn:
@@ -124,6 +149,8 @@ async def set_setting(key: str, value: str):
                ON CONFLICT (key) DO UPDATE SET value = $2, updated_at = NOW()""",
             key, value
         )
+    # Изменение через бота/tools видно сразу, а не через TTL
+    invalidate_setting(key)
 
 
 # ─── Сообщения ───────────────────────────────────────────────
@@ -445,6 +472,14 @@ async def has_similar_active_task(description: str) -> bool:
         return exists
 
 
+async def get_active_task_descriptions() -> list[str]:
+    """Описания всех активных задач — для дедупликации пачки без запроса на каждую."""
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        rows = await conn.fetch("SELECT description FROM tasks WHERE status = 'active'")
+        return [r["description"] or "" for r in rows]
+
+
 async def create_task(
     task_type: str,
     description: str,
@@ -598,7 +633,7 @@ async def get_recent_chat_messages(chat_id: int, since: datetime, limit: int = 3
     pool = await get_pool()
     async with pool.acquire() as conn:
         rows = await conn.fetch(
-            """SELECT sender_id, sender_name, text, timestamp
+            """SELECT id, sender_id, sender_name, text, timestamp
                FROM messages
                WHERE chat_id = $1 AND timestamp >= $2
                ORDER BY timestamp DESC
@@ -775,16 +810,37 @@ async def add_to_confidence_queue(
         return row["id"]
 
 
+async def take_daily_slot(name: str, day, limit: int) -> bool:
+    """Атомарно +1 к дневному счётчику, если он ещё меньше limit.
+    False — лимит на этот день исчерпан (счётчик не меняется)."""
+    if limit <= 0:
+        return False
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        count = await conn.fetchval(
+            """INSERT INTO daily_counters (name, day, count)
+               VALUES ($1, $2, 1)
+               ON CONFLICT (name, day) DO UPDATE
+                 SET count = daily_counters.count + 1
+                 WHERE daily_counters.count < $3
+               RETURNING count""",
+            name, day, limit,
+        )
+        return count is not None
+
+
 async def get_pending_confidence(limit: int = 10) -> list:
+    """Неразрешённые несрочные элементы очереди — только поля для батч-разбора.
+    Возвращает asyncpg Record (доступ по ключу, без копирования в dict)."""
     pool = await get_pool()
     async with pool.acquire() as conn:
-        rows = await conn.fetch(
-            """SELECT * FROM confidence_queue
+        return await conn.fetch(
+            """SELECT id, sender_name, text_preview, predicted_type, created_at
+               FROM confidence_queue
                WHERE resolved = FALSE AND is_urgent = FALSE
                ORDER BY created_at ASC LIMIT $1""",
             limit
         )
-        return [dict(r) for r in rows]
 
 
 async def resolve_confidence(queue_id: int, actual_type: str,
@@ -792,12 +848,9 @@ async def resolve_confidence(queue_id: int, actual_type: str,
     """Разрешает элемент confidence-очереди + сохраняет feedback."""
     pool = await get_pool()
     async with pool.acquire() as conn:
-        await conn.execute(
-            "UPDATE confidence_queue SET resolved = TRUE WHERE id = $1",
-            queue_id
-        )
         row = await conn.fetchrow(
-            "SELECT message_id, predicted_type, confidence FROM confidence_queue WHERE id = $1",
+            """UPDATE confidence_queue SET resolved = TRUE WHERE id = $1
+               RETURNING message_id, predicted_type, confidence""",
             queue_id
         )
         if row:
@@ -810,6 +863,30 @@ async def resolve_confidence(queue_id: int, actual_type: str,
             )
 
 
+async def resolve_confidence_bulk(queue_ids: list[int], actual_type: str) -> list:
+    """Разрешает несколько элементов confidence-очереди одной транзакцией + feedback.
+    Возвращает разрешённые строки очереди (для создания задач)."""
+    if not queue_ids:
+        return []
+    pool = await get_pool()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            rows = await conn.fetch(
+                """UPDATE confidence_queue SET resolved = TRUE
+                   WHERE id = ANY($1::int[])
+                   RETURNING id, message_id, chat_id, sender_name, text_preview,
+                             predicted_type, confidence""",
+                queue_ids,
+            )
+            await conn.executemany(
+                """INSERT INTO classification_feedback
+                   (message_id, predicted_type, actual_type, predicted_confidence)
+                   VALUES ($1, $2, $3, $4)""",
+                [(r["message_id"], r["predicted_type"], actual_type, r["confidence"]) for r in rows],
+            )
+    return rows
+
+
 async def save_classification_feedback(
     message_id: int, predicted_type: str, actual_type: str,
     predicted_confidence: int = None, user_reason: str = None,
@@ -7,10 +7,12 @@ import json
 import logging
 import re as _re
 import subprocess
+import time
 from datetime import datetime, timedelta, timezone
 
 from aiogram import Bot, Dispatcher, F, Router
 from aiogram.enums import ChatAction
+from aiogram.exceptions import TelegramRetryAfter
 from aiogram.filters import Command
 from aiogram.types import (
     CallbackQuery,
@@ -125,28 +127,100 @@ def _md_to_html(text: str) -> str:
     return _re.sub(r'\*\*(.+?)\*\*', r'<b>\1</b>', text)
 
 
-async def send_to_owner(text: str, reply_markup=None, parse_mode: str = "HTML"):
-    """Отправка сообщения владельцу. Поддержка длинных сообщений и HTML."""
+async def send_to_owner(text: str, reply_markup=None, parse_mode: str = "HTML", start_part: int = 0):
+    """Отправка сообщения владельцу. Поддержка длинных сообщений и HTML.
+    start_part — с какой части продолжить (повтор после 429 без дублей)."""
     if parse_mode == "HTML":
         text = _md_to_html(text)
     parts = _split_message(text, max_len=4096)
     for i, part in enumerate(parts):
+        if i < start_part:
+            continue
         markup = reply_markup if i == len(parts) - 1 else None
         try:
-            await bot.send_message(
-                config.TELEGRAM_OWNER_ID,
-                part,
-                reply_markup=markup,
-                parse_mode=parse_mode,
-            )
-        except Exception:
-            # Если HTML-парсинг упал — отправляем без parse_mode
-            await bot.send_message(
-                config.TELEGRAM_OWNER_ID,
-                part,
-                reply_markup=markup,
-                parse_mode=None,
-            )
+            try:
+                await bot.send_message(
+                    config.TELEGRAM_OWNER_ID,
+                    part,
+                    reply_markup=markup,
+                    parse_mode=parse_mode,
+                )
+            except TelegramRetryAfter:
+                # 429 — не ошибка разметки: повтор без parse_mode тоже упрётся в лимит
+                raise
+            except Exception:
+                # Если HTML-парсинг упал — отправляем без parse_mode
+                await bot.send_message(
+                    config.TELEGRAM_OWNER_ID,
+                    part,
+                    reply_markup=markup,
+                    parse_mode=None,
+                )
+        except TelegramRetryAfter as e:
+            # Номер упавшей части — чтобы повтор продолжил с неё, не дублируя отправленные
+            e.failed_part = i
+            raise
+
+
+# Стриминг ответа: черновик правится не чаще раза в STREAM_EDIT_INTERVAL (лимиты Telegram)
+STREAM_EDIT_INTERVAL = 1.0
+STREAM_PREVIEW_MAX = 4000
+
+
+class _StreamingReply:
+    """Черновик ответа владельцу, который дописывается по мере генерации.
+    Промежуточный текст — без parse_mode (незакрытые теги), финал — HTML."""
+
+    def __init__(self, chat_id: int):
+        self._chat_id = chat_id
+        self._message_id = None
+        self._last_edit = 0.0
+        self._shown = ""
+
+    async def update(self, text: str):
+        now = time.monotonic()
+        if now - self._last_edit < STREAM_EDIT_INTERVAL:
+            return
+        preview = text[:STREAM_PREVIEW_MAX]
+        if not preview.strip() or preview == self._shown:
+            return
+        self._last_edit = now
+        try:
+            if self._message_id is None:
+                msg = await bot.send_message(self._chat_id, preview, parse_mode=None)
+                self._message_id = msg.message_id
+            else:
+                await bot.edit_message_text(
+                    preview, chat_id=self._chat_id, message_id=self._message_id, parse_mode=None,
+                )
+            self._shown = preview
+        except Exception as e:
+            logger.debug(f"Streaming draft update error: {e}")
+
+    async def finish(self, text: str):
+        """Финальный ответ: правка черновика; длинный ответ или нет черновика — send_to_owner."""
+        if self._message_id is None:
+            await send_to_owner(text)
+            return
+        parts = _split_message(_md_to_html(text), max_len=4096)
+        if len(parts) > 1:
+            try:
+                await bot.delete_message(self._chat_id, self._message_id)
+            except Exception:
+                pass
+            await send_to_owner(text)
+            return
+        for parse_mode in ("HTML", None):
+            try:
+                await bot.edit_message_text(
+                    parts[0] if parse_mode else text,
+                    chat_id=self._chat_id, message_id=self._message_id, parse_mode=parse_mode,
+                )
+                return
+            except Exception as e:
+                if "message is not modified" in str(e):
+                    return
+        logger.warning("Streaming: не удалось обновить черновик финальным ответом")
 
 
 # Callback для уведомлений из других модулей
@@ -264,7 +338,7 @@ async def notify_callback(text: str, **kwargs):
             extra["markup_type"] = "classify_low"
             _store_classify_extra(msg_id, extra)
 
-    await send_to_owner(text, reply_markup=markup)
+    await send_to_owner(text, reply_markup=markup, start_part=kwargs.get("start_part", 0))
 
 
 def _store_classify_extra(msg_id: int, extra: dict):
@@ -292,6 +366,102 @@ def _store_awaiting_feedback(user_id: int, data: dict):
         del _awaiting_feedback[uid]
 
 
+# ─── Батчинг уведомлений ─────────────────────────────────────
+
+_NOTIFY_BATCH_WINDOW = 0.5   # сек — уведомления в этом окне склеиваются
+_NOTIFY_BATCH_MAX_ITEMS = 20  # не ждём бесконечно при непрерывном потоке
+_NOTIFY_MAX_RETRIES = 3       # повторы при 429 от Telegram
+_NOTIFY_DRAIN_TIMEOUT = 10.0  # сек — дослать очередь при остановке, но не держать shutdown
+
+
+class BatchedNotifier:
+    """Обёртка над notify_callback: уведомления без кнопок, пришедшие почти
+    одновременно (шторм реконнектов, fallback AI), уходят одним сообщением.
+    Уведомления с кнопками отправляются отдельно; порядок сохраняется."""
+
+    def __init__(self, send, window: float = _NOTIFY_BATCH_WINDOW, max_len: int = 4096):
+        self._send = send
+        self._window = window
+        self._max_len = max_len
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    async def __call__(self, text: str, **kwargs):
+        await self._queue.put((text, kwargs))
+
+    async def run(self):
+        """Фоновый воркер: собирает пачку из очереди и отправляет.
+        При отмене (shutdown) досылает собранное и оставшееся в очереди."""
+        batch: list[tuple[str, dict]] = []
+        pending: list[tuple[str, dict]] = []
+        try:
+            while True:
+                batch.append(await self._queue.get())
+                while len(batch) < _NOTIFY_BATCH_MAX_ITEMS:
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), self._window))
+                    except asyncio.TimeoutError:
+                        break
+                pending, batch = self._merge(batch), []
+                while pending:
+                    await self._deliver(*pending[0])
+                    pending.pop(0)
+        finally:
+            await self._drain(pending, batch)
+
+    async def _drain(self, pending: list[tuple[str, dict]], batch: list[tuple[str, dict]]):
+        """Досылает недоставленное при остановке воркера, не дольше _NOTIFY_DRAIN_TIMEOUT."""
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        items = pending + self._merge(batch)
+        if not items:
+            return
+        sent = 0
+        try:
+            async with asyncio.timeout(_NOTIFY_DRAIN_TIMEOUT):
+                for text, kwargs in items:
+                    await self._deliver(text, kwargs)
+                    sent += 1
+        except TimeoutError:
+            logger.warning(f"Остановка: не отправлено уведомлений: {len(items) - sent}")
+
+    def _merge(self, batch: list[tuple[str, dict]]) -> list[tuple[str, dict]]:
+        """Склеивает подряд идущие простые тексты (без reply_markup_type) через пустую строку."""
+        merged = []
+        plain: list[str] = []
+        plain_len = 0
+        for text, kwargs in batch:
+            if kwargs.get("reply_markup_type"):
+                if plain:
+                    merged.append(("\n\n".join(plain), {}))
+                    plain, plain_len = [], 0
+                merged.append((text, dict(kwargs)))
+                continue
+            if plain and plain_len + len(text) + 2 > self._max_len:
+                merged.append(("\n\n".join(plain), {}))
+                plain, plain_len = [], 0
+            plain.append(text)
+            plain_len += len(text) + 2
+        if plain:
+            merged.append(("\n\n".join(plain), {}))
+        return merged
+
+    async def _deliver(self, text: str, kwargs: dict):
+        for attempt in range(_NOTIFY_MAX_RETRIES):
+            try:
+                await self._send(text, **kwargs)
+                return
+            except TelegramRetryAfter as e:
+                # Повтор — с упавшей части: уже доставленные части не дублируются.
+                # kwargs меняется на месте, чтобы и досылка при остановке продолжила с неё
+                kwargs["start_part"] = getattr(e, "failed_part", kwargs.get("start_part", 0))
+                logger.warning(f"Telegram 429, повтор через {e.retry_after}с ({attempt + 1}/{_NOTIFY_MAX_RETRIES})")
+                await asyncio.sleep(e.retry_after)
+            except Exception as e:
+                logger.error(f"Ошибка отправки уведомления: {e}", exc_info=True)
+                return
+        logger.error(f"Уведомление не отправлено после {_NOTIFY_MAX_RETRIES} попыток 429: {text[:100]}")
+
+
 # ─── Постоянная клавиатура ───────────────────────────────────
 
 MAIN_KEYBOARD = ReplyKeyboardMarkup(
@@ -321,6 +491,7 @@ async def cmd_help(message: Message):
         "/tasks     — активные задачи с дедлайнами\n"
         "/summary   — краткое содержание дня\n"
         "/health    — статус системы и модулей\n"
+        "/stats     — классификация: локально / кеш / AI\n"
         "/whitelist — чаты для мониторинга\n"
         "/blacklist — исключения из мониторинга\n"
         "/admin     — управление: перезапуск, логи, бэкап\n"
@@ -335,6 +506,10 @@ async def cmd_help(message: Message):
     await send_to_owner(text)
 
 
+# Короткие метки типа задачи в /tasks
+_TASK_TYPE_MARKS = {"task": "T", "promise_mine": "P>", "promise_incoming": ">P"}
+
+
 @router.message(Command("tasks"))
 @owner_only
 async def cmd_tasks(message: Message):
@@ -345,7 +520,7 @@ async def cmd_tasks(message: Message):
 
     lines = ["АКТИВНЫЕ ЗАДАЧИ:\n"]
     for t in tasks:
-        type_emoji = {"task": "T", "promise_mine": "P>", "promise_incoming": ">P"}.get(t["type"], "?")
+        type_emoji = _TASK_TYPE_MARKS.get(t["type"], "?")
         deadline_str = ""
         if t["deadline"]:
             deadline_str = f" | до {t['deadline'].strftime('%d.%m')}"
@@ -415,6 +590,25 @@ async def cmd_health(message: Message):
     await send_to_owner("\n".join(lines))
 
 
+@router.message(Command("stats"))
+@owner_only
+async def cmd_stats(message: Message):
+    sources = brain.classify_stats
+    cache = brain.classify_cache_stats
+    total = sum(sources.values())
+    lookups = cache["hits"] + cache["misses"]
+    hit_rate = f"{cache['hits'] * 100 / lookups:.0f}%" if lookups else "—"
+
+    lines = [
+        f"Классификация с запуска: {total}",
+        f"  пре-фильтр: {sources.get('prefilter', 0)}",
+        f"  кеш:        {sources.get('cache', 0)}",
+        f"  AI:         {sources.get('model', 0)}",
+        f"\nКеш: {cache['size']} записей, попаданий {cache['hits']} из {lookups} ({hit_rate})",
+    ]
+    await send_to_owner("\n".join(lines))
+
+
 @router.message(Command("mode"))
 @owner_only
 async def cmd_mode(message: Message):
@@ -1458,14 +1652,16 @@ async def handle_photo(message: Message):
     context = await build_context(question) if message.caption else ""
 
     try:
+        reply = _StreamingReply(config.TELEGRAM_OWNER_ID)
         answer = await brain.answer_query_with_image(
             question=question,
             image_base64=image_b64,
             media_type="image/jpeg",
             context=context,
             system_context=system_context,
+            on_text_delta=reply.update,
         )
-        await send_to_owner(answer)
+        await reply.finish(answer)
     except Exception as e:
         logger.error(f"Vision error: {e}", exc_info=True)
         await send_to_owner(f"Не удалось проанализировать изображение: {html_lib.escape(str(e))}")
@@ -1541,10 +1737,12 @@ async def handle_free_text(message: Message):
         # 4. Собираем динамический контекст
         dynamic_context = await _build_dynamic_context()
 
-        # 5. Вызываем модель с tools
+        # 5. Вызываем модель с tools (ответ стримится в черновик)
+        reply = _StreamingReply(config.TELEGRAM_OWNER_ID)
         result = await brain.ask_with_tools(
             messages=api_messages,
             dynamic_context=dynamic_context,
+            on_text_delta=reply.update,
         )
 
         answer_text = result["text"]
@@ -1556,8 +1754,8 @@ async def handle_free_text(message: Message):
             tool_calls=result.get("tool_calls"),
         )
 
-        # 7. Отправляем ответ
-        await send_to_owner(answer_text)
+        # 7. Отправляем ответ (финальная правка черновика)
+        await reply.finish(answer_text)
 
         # 8. Если AI показывал задачи — добавляем кнопки управления
         tool_calls = result.get("tool_calls") or []
@@ -9,6 +9,8 @@ import logging
 from datetime import datetime, timedelta, timezone
 from typing import Optional
 
+import orjson
+
 from src import config
 from src.db import (
     create_task,
@@ -253,17 +255,22 @@ TOOL_DEFINITIONS = [
 
 # ─── Исполнение tools ─────────────────────────────────────────
 
+def _tool_json(obj) -> str:
+    """Результат tool для модели: orjson (datetime — ISO, прочее — str)."""
+    return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
 async def execute_tool(tool_name: str, tool_input: dict) -> str:
     """Выполняет tool и возвращает результат как строку для модели."""
     try:
         handler = _TOOL_HANDLERS.get(tool_name)
         if not handler:
-            return json.dumps({"error": f"Неизвестный инструмент: {tool_name}"}, ensure_ascii=False)
+            return _tool_json({"error": f"Неизвестный инструмент: {tool_name}"})
         result = await handler(tool_input)
-        return json.dumps(result, ensure_ascii=False, default=str)
+        return _tool_json(result)
     except Exception as e:
         logger.error(f"Ошибка выполнения tool {tool_name}: {e}", exc_info=True)
-        return json.dumps({"error": str(e)}, ensure_ascii=False)
+        return _tool_json({"error": str(e)})
 
 
 async def _tool_create_task(params: dict) -> dict:
@@ -652,3 +659,6 @@ _TOOL_HANDLERS = {
     "manage_whitelist": _tool_manage_whitelist,
     "update_preferences": _tool_update_preferences,
 }
+
+# Tools без побочных эффектов — можно выполнять параллельно в одном раунде
+READ_ONLY_TOOLS = frozenset({"list_tasks", "search_memory", "get_chat_summary"})
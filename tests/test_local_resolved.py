@@ -0,0 +1,41 @@
+"""Локальная проверка «MEDIUM-задача разрешилась» (confidence_manager._local_resolved)."""
+import pytest
+
+from src import config
+from src.confidence_manager import _exclude_trigger, _local_resolved
+
+OWNER_ID = next(iter(config.OWNER_IDS))
+CONTACT_ID = OWNER_ID + 1
+
+TRIGGER_PHRASES = [
+    "Петя, подготовь отчёт по продажам к пятнице",
+    "Я отправил тебе договор, подпиши до пятницы",
+    "Иванову счёт завтра отправлю",
+]
+
+
+def _msg(msg_id: int, sender_id: int, text: str) -> dict:
+    return {"id": msg_id, "sender_id": sender_id, "sender_name": "?", "text": text}
+
+
+@pytest.mark.parametrize("text", TRIGGER_PHRASES)
+def test_trigger_message_does_not_resolve_its_own_task(text):
+    recent = [_msg(1, OWNER_ID, text)]
+    assert _local_resolved(_exclude_trigger(recent, 1)) is False
+
+
+@pytest.mark.parametrize("text", [TRIGGER_PHRASES[0], TRIGGER_PHRASES[2]])
+def test_topic_overlap_is_left_to_ai(text):
+    # Сообщение владельца по теме задачи без «сделал/готово» — решает AI, а не «разрешилась»
+    recent = [_msg(2, OWNER_ID, text), _msg(1, CONTACT_ID, "Подготовь отчёт по продажам")]
+    assert _local_resolved(_exclude_trigger(recent, 1)) is None
+
+
+def test_explicit_done_resolves():
+    recent = [_msg(2, OWNER_ID, "готово"), _msg(1, OWNER_ID, TRIGGER_PHRASES[0])]
+    assert _local_resolved(_exclude_trigger(recent, 1)) is True
+
+
+@pytest.mark.parametrize("text", ["ещё не сделал", "не готово пока", "Ты отправил счёт?"])
+def test_negation_or_question_is_left_to_ai(text):
+    assert _local_resolved([_msg(2, OWNER_ID, text)]) is None